@@ -23,15 +23,19 @@ Run `python generator.py --help` for full option list.
 """
 
 import argparse
+import functools
+import heapq
+import importlib.util
+import itertools
 import json
 import math
 import os
 import random
 import sys
 import time as time_module
-import uuid
-from collections import defaultdict
-from datetime import datetime, timedelta, timezone
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone
+from operator import itemgetter
 from typing import List, Dict, Any, Optional, Tuple
 
 import fastavro
@@ -57,8 +61,14 @@ DEFAULTS = {
     "output_dir": "./sample_data",
     "seed": 42,
     "city": "madrid",
+    "avro_codec": "deflate",
 }
 
+# Avro container codecs offered on the CLI (snappy needs cramjam or python-snappy)
+AVRO_CODECS = ["null", "deflate", "snappy"]
+# Target Avro block size in bytes: larger blocks compress better and cut framing
+AVRO_SYNC_INTERVAL = 1 << 20
+
 CANCELLATION_REASONS = [
     "customer_cancelled",
     "restaurant_closed",
@@ -119,9 +129,24 @@ WEEKEND_WEIGHTS = [
 # Helpers
 # ---------------------------------------------------------------------------
 
-def new_uuid(rng):
-    """Generate a reproducible UUID v4 using the seeded RNG."""
-    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+def new_uuids(rng, n):
+    """Generate n reproducible UUID v4 strings from a single bulk RNG draw."""
+    if n <= 0:
+        return []
+    raw = bytearray(rng.getrandbits(128 * n).to_bytes(16 * n, "big"))
+    out = []
+    for i in range(0, 16 * n, 16):
+        raw[i + 6] = (raw[i + 6] & 0x0F) | 0x40  # version 4
+        raw[i + 8] = (raw[i + 8] & 0x3F) | 0x80  # RFC 4122 variant
+        h = raw[i:i + 16].hex()
+        out.append("{}-{}-{}-{}-{}".format(h[:8], h[8:12], h[12:16], h[16:20], h[20:]))
+    return out
+
+
+def uuid_stream(rng, batch_size=256):
+    """Endless iterator of reproducible UUIDs, drawn from the RNG in batches."""
+    while True:
+        yield from new_uuids(rng, batch_size)
 
 
 def epoch_ms(dt):
@@ -129,11 +154,17 @@ def epoch_ms(dt):
     return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
 
 
-def random_coords(zone, rng):
-    """Random lat/lon near zone center."""
-    lat = zone["lat"] + rng.uniform(-zone["radius"], zone["radius"])
-    lon = zone["lon"] + rng.uniform(-zone["radius"], zone["radius"])
-    return round(lat, 6), round(lon, 6)
+def coord_offsets(rng, k):
+    """Draw k unit (lat, lon) offset pairs in [-1, 1) for offset_coords."""
+    random_ = rng.random
+    return [(2.0 * random_() - 1.0, 2.0 * random_() - 1.0) for _ in range(k)]
+
+
+def offset_coords(zone, offset):
+    """Scale a unit offset pair to the zone radius around its center."""
+    radius = zone["radius"]
+    return (round(zone["lat"] + offset[0] * radius, 6),
+            round(zone["lon"] + offset[1] * radius, 6))
 
 
 def zone_distance(z1, z2):
@@ -155,31 +186,64 @@ def is_restaurant_open(restaurant, hour):
     return False
 
 
-def sample_order_time(rng, base_date, is_weekend, surge_factor):
-    """Sample a realistic order timestamp using rejection sampling."""
-    max_weight = surge_factor * 2.5
-    for _ in range(10000):
-        hour = rng.randint(0, 23)
-        minute = rng.randint(0, 59)
-        second = rng.randint(0, 59)
-        w = demand_multiplier(hour, is_weekend)
-        if hour in range(12, 15) or hour in range(19, 23):
-            w *= surge_factor
-        if rng.uniform(0, max_weight) < w:
-            return base_date.replace(hour=hour, minute=minute, second=second,
-                                     microsecond=0)
-    # Fallback (should not normally reach here)
-    return base_date.replace(hour=12, minute=0, second=0, microsecond=0)
-
-
-def sample_prep_time(restaurant, rng):
-    """Sample prep time from per-restaurant normal distribution (Box-Muller)."""
-    mean = restaurant["prep_mean"]
-    std = restaurant["prep_std"]
-    u1 = max(1e-10, rng.random())
-    u2 = rng.random()
-    z = math.sqrt(-2.0 * math.log(u1)) * math.cos(2.0 * math.pi * u2)
-    value = mean + std * z
+def restaurants_by_hour(restaurants):
+    """Bucket restaurants by opening hour; hours with none open fall back to all."""
+    return [
+        [r for r in restaurants if is_restaurant_open(r, h)] or restaurants
+        for h in range(24)
+    ]
+
+
+# Hours whose demand is multiplied by the surge factor (lunch and dinner peaks)
+SURGE_HOURS = frozenset([12, 13, 14, 19, 20, 21, 22])
+
+
+@functools.lru_cache(maxsize=None)
+def hour_cdf(is_weekend, surge_factor):
+    """Cumulative distribution over the 24 hours, with peak hours surged."""
+    weights = [
+        demand_multiplier(h, is_weekend) * (surge_factor if h in SURGE_HOURS else 1.0)
+        for h in range(24)
+    ]
+    total = sum(weights)
+    return tuple(c / total for c in itertools.accumulate(weights))
+
+
+def sample_order_times(rng, is_weekend, surge_factor, n):
+    """
+    Sample n order times at once as seconds since midnight: hours in one
+    weighted draw, then a second within each hour.
+    """
+    hours = rng.choices(range(24), cum_weights=hour_cdf(is_weekend, surge_factor), k=n)
+    randrange = rng.randrange
+    return [hour * 3600 + randrange(3600) for hour in hours]
+
+
+def uniform_ints(rng, n, lo, hi):
+    """Draw n integers uniformly from [lo, hi], one random() call each."""
+    random_ = rng.random
+    span = hi - lo + 1
+    return [lo + int(random_() * span) for _ in range(n)]
+
+
+def standard_normals(rng, n):
+    """Draw n standard normal variates, using both Box-Muller outputs per pair."""
+    random_ = rng.random
+    log, sqrt, cos, sin, two_pi = math.log, math.sqrt, math.cos, math.sin, 2.0 * math.pi
+    out = []
+    for _ in range((n + 1) // 2):
+        u1 = max(1e-10, random_())
+        theta = two_pi * random_()
+        r = sqrt(-2.0 * log(u1))
+        out.append(r * cos(theta))
+        out.append(r * sin(theta))
+    del out[n:]
+    return out
+
+
+def prep_time_from_z(restaurant, z):
+    """Scale a standard normal draw to the restaurant's prep time distribution."""
+    value = restaurant["prep_mean"] + restaurant["prep_std"] * z
     return max(180, int(value))  # minimum 3 minutes
 
 
@@ -208,19 +272,16 @@ def build_restaurants(n, zones, rng):
     """Build restaurants with zone assignment, opening hours, and prep profiles."""
     restaurants = []
     zone_ids = [z["id"] for z in zones]
-    zone_weights = [z["weight"] for z in zones]
-    profile_names = [p[0] for p in RESTAURANT_PROFILES]
-    profile_weights = [p[2] for p in RESTAURANT_PROFILES]
-    profile_map = {p[0]: p for p in RESTAURANT_PROFILES}
-
-    for i in range(n):
-        zone_id = rng.choices(zone_ids, weights=zone_weights)[0]
-        profile_name = rng.choices(profile_names, weights=profile_weights)[0]
-        profile = profile_map[profile_name]
+    zone_cum = list(itertools.accumulate(z["weight"] for z in zones))
+    profile_cum = list(itertools.accumulate(p[2] for p in RESTAURANT_PROFILES))
+
+    zone_draws = rng.choices(zone_ids, cum_weights=zone_cum, k=n)
+    profile_draws = rng.choices(RESTAURANT_PROFILES, cum_weights=profile_cum, k=n)
+    for i, (zone_id, profile) in enumerate(zip(zone_draws, profile_draws)):
         restaurants.append({
             "id": "rest_{:03d}".format(i + 1),
             "zone_id": zone_id,
-            "profile": profile_name,
+            "profile": profile[0],
             "open_ranges": profile[1],
             "prep_mean": profile[3],
             "prep_std": profile[4],
@@ -230,16 +291,13 @@ def build_restaurants(n, zones, rng):
 
 def build_couriers(n, zones, rng):
     """Build couriers with initial zone assignment."""
-    couriers = []
     zone_ids = [z["id"] for z in zones]
-    zone_weights = [z["weight"] for z in zones]
-    for i in range(n):
-        zone_id = rng.choices(zone_ids, weights=zone_weights)[0]
-        couriers.append({
-            "id": "courier_{:03d}".format(i + 1),
-            "zone_id": zone_id,
-        })
-    return couriers
+    zone_cum = list(itertools.accumulate(z["weight"] for z in zones))
+    zone_draws = rng.choices(zone_ids, cum_weights=zone_cum, k=n)
+    return [
+        {"id": "courier_{:03d}".format(i + 1), "zone_id": zone_id}
+        for i, zone_id in enumerate(zone_draws)
+    ]
 
 
 def build_customers(n, rng):
@@ -251,25 +309,27 @@ def build_customers(n, rng):
 # Placement generation  (step 1: what orders are placed, when, and where)
 # ---------------------------------------------------------------------------
 
-def generate_placements(cfg, restaurants, customers, rng, base_date):
+def generate_placements(cfg, open_by_hour, customers, rng, base_date):
     """Generate base order placements (time, restaurant, customer)."""
-    is_weekend = cfg["is_weekend"]
+    n = cfg["num_orders"]
+    promo_prob = cfg["promo_prob"]
+    base_ms = epoch_ms(base_date)
+    placed_secs = sample_order_times(rng, cfg["is_weekend"], cfg["surge_factor"], n)
+    random_ = rng.random
+    choice = rng.choice
+    customer_ids = rng.choices(customers, k=n)
+    base_values = [round(8.0 + 57.0 * random_(), 2) for _ in range(n)]
     placements = []
-    for _ in range(cfg["num_orders"]):
-        placed_dt = sample_order_time(rng, base_date, is_weekend, cfg["surge_factor"])
-        hour = placed_dt.hour
-        open_rests = [r for r in restaurants if is_restaurant_open(r, hour)]
-        if not open_rests:
-            open_rests = restaurants
-        restaurant = rng.choice(open_rests)
-        customer_id = rng.choice(customers)
-        order_value = round(rng.uniform(8.0, 65.0), 2)
-        promo = rng.random() < cfg["promo_prob"]
+    for secs, customer_id, order_value in zip(placed_secs, customer_ids, base_values):
+        hour = secs // 3600
+        restaurant = choice(open_by_hour[hour])
+        promo = random_() < promo_prob
         if promo:
-            order_value = round(order_value * rng.uniform(0.7, 0.9), 2)
+            order_value = round(order_value * (0.7 + 0.2 * random_()), 2)
 
         placements.append({
-            "placed_dt": placed_dt,
+            "hour": hour,
+            "placed_ms": base_ms + secs * 1000,
             "customer_id": customer_id,
             "restaurant": restaurant,
             "order_value": order_value,
@@ -281,32 +341,31 @@ def generate_placements(cfg, restaurants, customers, rng, base_date):
     return placements
 
 
-def add_fraud_clusters(placements, cfg, customers, restaurants, rng, base_date, stats):
+def add_fraud_clusters(placements, cfg, customers, open_by_hour, rng, base_date, stats):
     """Add fraud cluster placements: bursts of cancellations from the same customer."""
     num_clusters = max(0, round(cfg["num_orders"] * cfg["fraud_cluster_prob"]))
     if num_clusters == 0:
         return
 
+    base_ms = epoch_ms(base_date)
+    randint = rng.randint
+    choice = rng.choice
+    uniform = rng.uniform
     for _ in range(num_clusters):
-        customer_id = rng.choice(customers)
-        peak_hour = rng.choice([12, 13, 19, 20, 21])
-        base_minute = rng.randint(0, 45)
-        cluster_size = rng.randint(3, 5)
+        customer_id = choice(customers)
+        peak_hour = choice([12, 13, 19, 20, 21])
+        base_minute = randint(0, 45)
+        cluster_size = randint(3, 5)
+        open_rests = open_by_hour[peak_hour]
 
         for j in range(cluster_size):
-            open_rests = [r for r in restaurants if is_restaurant_open(r, peak_hour)]
-            if not open_rests:
-                open_rests = restaurants
-            restaurant = rng.choice(open_rests)
-            order_value = round(rng.uniform(8.0, 65.0), 2)
-            placed_dt = base_date.replace(
-                hour=peak_hour,
-                minute=base_minute + rng.randint(0, 14),
-                second=rng.randint(0, 59),
-                microsecond=0,
-            )
+            restaurant = choice(open_rests)
+            order_value = round(uniform(8.0, 65.0), 2)
+            minute = base_minute + randint(0, 14)
+            second = randint(0, 59)
             placements.append({
-                "placed_dt": placed_dt,
+                "hour": peak_hour,
+                "placed_ms": base_ms + ((peak_hour * 60 + minute) * 60 + second) * 1000,
                 "customer_id": customer_id,
                 "restaurant": restaurant,
                 "order_value": order_value,
@@ -325,6 +384,7 @@ def add_zone_surge(placements, cfg, zones, restaurants, customers, rng, base_dat
     peak_hour = rng.choice([12, 13, 19, 20, 21])
     base_minute = rng.randint(0, 45)
     num_surge = max(10, cfg["num_orders"] // 10)
+    base_ms = epoch_ms(base_date)
 
     zone_rests = [r for r in restaurants if r["zone_id"] == zone_id]
     if not zone_rests:
@@ -335,21 +395,22 @@ def add_zone_surge(placements, cfg, zones, restaurants, customers, rng, base_dat
     stats["zone_surge_minute"] = base_minute
     stats["zone_surge_orders"] = num_surge
 
+    randint = rng.randint
+    choice = rng.choice
+    uniform = rng.uniform
+    random_ = rng.random
     for _ in range(num_surge):
-        customer_id = rng.choice(customers)
-        restaurant = rng.choice(zone_rests)
-        order_value = round(rng.uniform(8.0, 65.0), 2)
-        promo = rng.random() < cfg["promo_prob"]
+        customer_id = choice(customers)
+        restaurant = choice(zone_rests)
+        order_value = round(uniform(8.0, 65.0), 2)
+        promo = random_() < cfg["promo_prob"]
         if promo:
-            order_value = round(order_value * rng.uniform(0.7, 0.9), 2)
-        placed_dt = base_date.replace(
-            hour=peak_hour,
-            minute=base_minute + rng.randint(0, 14),
-            second=rng.randint(0, 59),
-            microsecond=0,
-        )
+            order_value = round(order_value * uniform(0.7, 0.9), 2)
+        minute = base_minute + randint(0, 14)
+        second = randint(0, 59)
         placements.append({
-            "placed_dt": placed_dt,
+            "hour": peak_hour,
+            "placed_ms": base_ms + ((peak_hour * 60 + minute) * 60 + second) * 1000,
             "customer_id": customer_id,
             "restaurant": restaurant,
             "order_value": order_value,
@@ -364,36 +425,63 @@ def add_zone_surge(placements, cfg, zones, restaurants, customers, rng, base_dat
 # Courier assignment (zone-aware with availability tracking)
 # ---------------------------------------------------------------------------
 
-def assign_courier(courier_state, zone_id, zones, order_time_ms, rng):
+def zone_distance_matrix(zones):
+    """Precompute pairwise zone-center distances: dist[zone_a][zone_b]."""
+    return {a["id"]: {b["id"]: zone_distance(a, b) for b in zones} for a in zones}
+
+
+def init_dispatch(couriers, zone_dist):
+    """
+    Build the dispatch pool used by assign_courier:
+      - idle_by_zone:  zone_id -> FIFO of idle courier ids (longest idle first)
+      - busy_heap:     heap of (available_at_ms, courier_id) for busy couriers
+      - nearest_zones: zone_id -> other zone ids sorted by distance
+    """
+    idle_by_zone = {zid: deque() for zid in zone_dist}
+    for c in couriers:
+        idle_by_zone[c["zone_id"]].append(c["id"])
+    nearest_zones = {
+        zid: sorted((z for z in zone_dist if z != zid), key=zone_dist[zid].get)
+        for zid in zone_dist
+    }
+    return {
+        "idle_by_zone": idle_by_zone,
+        "busy_heap": [],
+        "nearest_zones": nearest_zones,
+    }
+
+
+def assign_courier(dispatch, courier_state, zone_id, order_time_ms):
     """
     Assign a courier to an order with zone-aware priority:
       1. Available couriers in the same zone
       2. Available couriers in the nearest zone
       3. Courier that becomes free soonest
+    The assigned courier is removed from the pool; call release_courier
+    once their delivery time is known.
     """
-    zone_map = {z["id"]: z for z in zones}
+    idle_by_zone = dispatch["idle_by_zone"]
+    busy_heap = dispatch["busy_heap"]
 
-    # Couriers available at or before this order's time
-    available = []
-    for cid, state in courier_state.items():
-        if state["available_at"] <= order_time_ms:
-            available.append((cid, state))
+    # Couriers that finished at or before this order's time become idle
+    # in the zone of their last delivery
+    while busy_heap and busy_heap[0][0] <= order_time_ms:
+        _, cid = heapq.heappop(busy_heap)
+        idle_by_zone[courier_state[cid]["zone"]].append(cid)
 
-    if available:
-        same_zone = [(cid, s) for cid, s in available if s["zone"] == zone_id]
-        if same_zone:
-            return rng.choice(same_zone)[0]
-
-        order_zone = zone_map.get(zone_id)
-        if order_zone:
-            available.sort(key=lambda x: zone_distance(
-                zone_map.get(x[1]["zone"], order_zone), order_zone
-            ))
-        return available[0][0]
+    if idle_by_zone[zone_id]:
+        return idle_by_zone[zone_id].popleft()
+    for other_zone in dispatch["nearest_zones"][zone_id]:
+        if idle_by_zone[other_zone]:
+            return idle_by_zone[other_zone].popleft()
 
     # No one available right now — pick the courier that frees up soonest
-    soonest_cid = min(courier_state, key=lambda cid: courier_state[cid]["available_at"])
-    return soonest_cid
+    return heapq.heappop(busy_heap)[1]
+
+
+def release_courier(dispatch, courier_id, available_at_ms):
+    """Mark an assigned courier as busy until available_at_ms."""
+    heapq.heappush(dispatch["busy_heap"], (available_at_ms, courier_id))
 
 
 # ---------------------------------------------------------------------------
@@ -402,10 +490,10 @@ def assign_courier(courier_state, zone_id, zones, order_time_ms, rng):
 
 def process_placements(placements, cfg, zones, couriers, rng, stats):
     """
-    Process sorted placements into order lifecycle events.
+    Process placements (sorted by placed_ms) into order lifecycle events.
     Returns (order_events, courier_delivery_log, courier_state).
     """
-    zone_map = {z["id"]: z for z in zones}
+    dispatch = init_dispatch(couriers, zone_distance_matrix(zones))
     order_events = []
 
     # Initialise courier state
@@ -418,9 +506,24 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
 
     # Delivery log for courier event generation: courier_id -> list of deliveries
     courier_delivery_log = defaultdict(list)
-
-    for pl in placements:
-        placed_dt = pl["placed_dt"]
+    uuid_iter = uuid_stream(rng)
+
+    # Pre-drawn per-order randomness: one prep-time normal, assignment and
+    # delivery offsets, and four ingestion delays (one per lifecycle slot)
+    n = len(placements)
+    prep_z = standard_normals(rng, n)
+    assign_secs = uniform_ints(rng, n, 30, 120)
+    delivery_secs_normal = uniform_ints(rng, n, 600, 2400)
+    proc_delays = uniform_ints(rng, 4 * n, 1000, 10000)
+    randint = rng.randint
+    random_ = rng.random
+
+    # Order value stats are kept as running aggregates, not a list of values
+    value_sum = 0.0
+    value_min = stats["order_value_min"]
+    value_max = stats["order_value_max"]
+
+    for i, (pl, z) in enumerate(zip(placements, prep_z)):
         customer_id = pl["customer_id"]
         restaurant = pl["restaurant"]
         zone_id = restaurant["zone_id"]
@@ -428,23 +531,27 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
         promo = pl["promo"]
         force_cancel = pl["force_cancel"]
 
-        order_id = new_uuid(rng)
-        placed_ms = epoch_ms(placed_dt)
-        app_version = "1.1.0" if rng.random() < 0.05 else "1.0.0"
-        proc_delay = rng.randint(1000, 10000)
+        order_id = next(uuid_iter)
+        placed_ms = pl["placed_ms"]
+        app_version = "1.1.0" if random_() < 0.05 else "1.0.0"
+        d = 4 * i
 
         # Stats tracking
         stats["orders_per_zone"][zone_id] += 1
-        stats["orders_per_hour"][placed_dt.hour] += 1
-        stats["order_values"].append(order_value)
+        stats["orders_per_hour"][pl["hour"]] += 1
+        value_sum += order_value
+        if order_value < value_min:
+            value_min = order_value
+        if order_value > value_max:
+            value_max = order_value
         if pl["is_fraud"]:
             stats["fraud_order_events"] += 1
         if pl["is_surge"]:
             stats["surge_order_events"] += 1
 
-        cancelled = force_cancel or (rng.random() < cfg["cancel_prob"])
-        missing_pickup = (not cancelled) and (rng.random() < cfg["missing_step_prob"])
-        impossible_duration = (not cancelled) and (rng.random() < cfg["impossible_duration_prob"])
+        cancelled = force_cancel or (random_() < cfg["cancel_prob"])
+        missing_pickup = (not cancelled) and (random_() < cfg["missing_step_prob"])
+        impossible_duration = (not cancelled) and (random_() < cfg["impossible_duration_prob"])
 
         if missing_pickup:
             stats["missing_step_orders"] += 1
@@ -453,11 +560,11 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
 
         # --- ORDER_PLACED ---
         order_events.append({
-            "event_id": new_uuid(rng),
+            "event_id": next(uuid_iter),
             "order_id": order_id,
             "event_type": "ORDER_PLACED",
             "timestamp": placed_ms,
-            "processing_timestamp": placed_ms + proc_delay,
+            "processing_timestamp": placed_ms + proc_delays[d],
             "customer_id": customer_id,
             "restaurant_id": restaurant["id"],
             "courier_id": None,
@@ -470,15 +577,17 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
         })
 
         if cancelled:
-            cancel_dt = placed_dt + timedelta(seconds=rng.randint(30, 300))
-            cancel_ms = epoch_ms(cancel_dt)
-            reason = "customer_cancelled" if force_cancel else rng.choice(CANCELLATION_REASONS)
+            cancel_ms = placed_ms + randint(30, 300) * 1000
+            if force_cancel:
+                reason = "customer_cancelled"
+            else:
+                reason = CANCELLATION_REASONS[int(random_() * len(CANCELLATION_REASONS))]
             order_events.append({
-                "event_id": new_uuid(rng),
+                "event_id": next(uuid_iter),
                 "order_id": order_id,
                 "event_type": "CANCELLED",
                 "timestamp": cancel_ms,
-                "processing_timestamp": cancel_ms + rng.randint(1000, 10000),
+                "processing_timestamp": cancel_ms + proc_delays[d + 1],
                 "customer_id": customer_id,
                 "restaurant_id": restaurant["id"],
                 "courier_id": None,
@@ -492,16 +601,15 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
             continue
 
         # --- COURIER_ASSIGNED ---
-        courier_id = assign_courier(courier_state, zone_id, zones, placed_ms, rng)
-        assign_dt = placed_dt + timedelta(seconds=rng.randint(30, 120))
-        assign_ms = epoch_ms(assign_dt)
+        courier_id = assign_courier(dispatch, courier_state, zone_id, placed_ms)
+        assign_ms = placed_ms + assign_secs[i] * 1000
 
         order_events.append({
-            "event_id": new_uuid(rng),
+            "event_id": next(uuid_iter),
             "order_id": order_id,
             "event_type": "COURIER_ASSIGNED",
             "timestamp": assign_ms,
-            "processing_timestamp": assign_ms + rng.randint(1000, 10000),
+            "processing_timestamp": assign_ms + proc_delays[d + 1],
             "customer_id": customer_id,
             "restaurant_id": restaurant["id"],
             "courier_id": courier_id,
@@ -514,16 +622,15 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
         })
 
         # --- PICKED_UP ---
-        prep_secs = sample_prep_time(restaurant, rng)
+        prep_secs = prep_time_from_z(restaurant, z)
         if not missing_pickup:
-            pickup_dt = assign_dt + timedelta(seconds=prep_secs)
-            pickup_ms = epoch_ms(pickup_dt)
+            pickup_ms = assign_ms + prep_secs * 1000
             order_events.append({
-                "event_id": new_uuid(rng),
+                "event_id": next(uuid_iter),
                 "order_id": order_id,
                 "event_type": "PICKED_UP",
                 "timestamp": pickup_ms,
-                "processing_timestamp": pickup_ms + rng.randint(1000, 10000),
+                "processing_timestamp": pickup_ms + proc_delays[d + 2],
                 "customer_id": customer_id,
                 "restaurant_id": restaurant["id"],
                 "courier_id": courier_id,
@@ -535,23 +642,21 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
                 "app_version": app_version,
             })
         else:
-            pickup_dt = assign_dt + timedelta(seconds=rng.randint(300, 900))
-            pickup_ms = epoch_ms(pickup_dt)
+            pickup_ms = assign_ms + randint(300, 900) * 1000
 
         # --- DELIVERED ---
         if impossible_duration:
-            delivery_secs = rng.randint(1, 10)
+            delivery_secs = randint(1, 10)
         else:
-            delivery_secs = rng.randint(600, 2400)
-        delivered_dt = pickup_dt + timedelta(seconds=delivery_secs)
-        delivered_ms = epoch_ms(delivered_dt)
+            delivery_secs = delivery_secs_normal[i]
+        delivered_ms = pickup_ms + delivery_secs * 1000
 
         order_events.append({
-            "event_id": new_uuid(rng),
+            "event_id": next(uuid_iter),
             "order_id": order_id,
             "event_type": "DELIVERED",
             "timestamp": delivered_ms,
-            "processing_timestamp": delivered_ms + rng.randint(1000, 10000),
+            "processing_timestamp": delivered_ms + proc_delays[d + 3],
             "customer_id": customer_id,
             "restaurant_id": restaurant["id"],
             "courier_id": courier_id,
@@ -566,6 +671,7 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
         # Update courier state: busy until delivery, stays in delivery zone
         courier_state[courier_id]["available_at"] = delivered_ms
         courier_state[courier_id]["zone"] = zone_id
+        release_courier(dispatch, courier_id, delivered_ms)
 
         # Record delivery for courier event generation
         courier_delivery_log[courier_id].append({
@@ -576,6 +682,11 @@ def process_placements(placements, cfg, zones, couriers, rng, stats):
             "delivered_ms": delivered_ms,
         })
 
+    stats["order_value_count"] += n
+    stats["order_value_sum"] += value_sum
+    stats["order_value_min"] = value_min
+    stats["order_value_max"] = value_max
+
     return order_events, courier_delivery_log, courier_state
 
 
@@ -588,32 +699,42 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
     """Generate courier status events anchored to the delivery log."""
     events = []
     zone_map = {z["id"]: z for z in zones}
+    base_ms = epoch_ms(base_date)
+    randint = rng.randint
+    random_ = rng.random
+    choice = rng.choice
+
+    uuid_iter = uuid_stream(rng)
 
     for courier in couriers:
         cid = courier["id"]
         initial_zone_id = courier["zone_id"]
         zone = zone_map.get(initial_zone_id, zones[0])
-        session_id = new_uuid(rng)
-        app_version = "1.1.0" if rng.random() < 0.05 else "1.0.0"
+        session_id = next(uuid_iter)
+        app_version = "1.1.0" if random_() < 0.05 else "1.0.0"
 
         # Courier comes online at a random hour
-        online_hour = rng.choice([10, 11, 17, 18, 19])
-        online_dt = base_date.replace(
-            hour=online_hour,
-            minute=rng.randint(0, 59),
-            second=rng.randint(0, 59),
-            microsecond=0,
-        )
-        online_ms = epoch_ms(online_dt)
-        lat, lon = random_coords(zone, rng)
+        online_hour = choice([10, 11, 17, 18, 19])
+        minute = randint(0, 59)
+        second = randint(0, 59)
+        online_ms = base_ms + ((online_hour * 60 + minute) * 60 + second) * 1000
+
+        # Process deliveries assigned to this courier
+        deliveries = delivery_log.get(cid, [])
+        deliveries.sort(key=itemgetter("assigned_ms"))
+        went_offline_mid = False
+
+        # One location per event: ONLINE, AVAILABLE, three per delivery, OFFLINE
+        offsets = iter(coord_offsets(rng, 3 + 3 * len(deliveries)))
+        lat, lon = offset_coords(zone, next(offsets))
 
         # ONLINE
         events.append({
-            "event_id": new_uuid(rng),
+            "event_id": next(uuid_iter),
             "courier_id": cid,
             "event_type": "ONLINE",
             "timestamp": online_ms,
-            "processing_timestamp": online_ms + rng.randint(1000, 5000),
+            "processing_timestamp": online_ms + randint(1000, 5000),
             "zone_id": zone["id"],
             "latitude": lat,
             "longitude": lon,
@@ -624,15 +745,14 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
         })
 
         # AVAILABLE right after coming online
-        avail_dt = online_dt + timedelta(seconds=rng.randint(10, 60))
-        avail_ms = epoch_ms(avail_dt)
-        lat, lon = random_coords(zone, rng)
+        avail_ms = online_ms + randint(10, 60) * 1000
+        lat, lon = offset_coords(zone, next(offsets))
         events.append({
-            "event_id": new_uuid(rng),
+            "event_id": next(uuid_iter),
             "courier_id": cid,
             "event_type": "AVAILABLE",
             "timestamp": avail_ms,
-            "processing_timestamp": avail_ms + rng.randint(1000, 5000),
+            "processing_timestamp": avail_ms + randint(1000, 5000),
             "zone_id": zone["id"],
             "latitude": lat,
             "longitude": lon,
@@ -642,9 +762,8 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
             "app_version": app_version,
         })
 
-        # Process deliveries assigned to this courier
-        deliveries = sorted(delivery_log.get(cid, []), key=lambda x: x["assigned_ms"])
-        went_offline_mid = False
+        # Latest event time in this shift, for placing the end-of-shift OFFLINE
+        last_ts = avail_ms
 
         for i, delivery in enumerate(deliveries):
             dzone = zone_map.get(delivery["zone_id"], zone)
@@ -653,19 +772,15 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
             if (not went_offline_mid
                     and i == len(deliveries) // 2
                     and len(deliveries) > 0
-                    and rng.random() < cfg["mid_delivery_offline_prob"]):
-                offline_dt_raw = datetime.fromtimestamp(
-                    delivery["assigned_ms"] / 1000, tz=timezone.utc
-                ).replace(tzinfo=None)
-                offline_dt = offline_dt_raw + timedelta(seconds=rng.randint(60, 300))
-                offline_ms = epoch_ms(offline_dt)
-                lat, lon = random_coords(dzone, rng)
+                    and random_() < cfg["mid_delivery_offline_prob"]):
+                offline_ms = delivery["assigned_ms"] + randint(60, 300) * 1000
+                lat, lon = offset_coords(dzone, next(offsets))
                 events.append({
-                    "event_id": new_uuid(rng),
+                    "event_id": next(uuid_iter),
                     "courier_id": cid,
                     "event_type": "OFFLINE",
                     "timestamp": offline_ms,
-                    "processing_timestamp": offline_ms + rng.randint(1000, 5000),
+                    "processing_timestamp": offline_ms + randint(1000, 5000),
                     "zone_id": dzone["id"],
                     "latitude": lat,
                     "longitude": lon,
@@ -679,13 +794,13 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
                 break
 
             # PICKING_UP
-            lat, lon = random_coords(dzone, rng)
+            lat, lon = offset_coords(dzone, next(offsets))
             events.append({
-                "event_id": new_uuid(rng),
+                "event_id": next(uuid_iter),
                 "courier_id": cid,
                 "event_type": "PICKING_UP",
                 "timestamp": delivery["pickup_ms"],
-                "processing_timestamp": delivery["pickup_ms"] + rng.randint(1000, 5000),
+                "processing_timestamp": delivery["pickup_ms"] + randint(1000, 5000),
                 "zone_id": delivery["zone_id"],
                 "latitude": lat,
                 "longitude": lon,
@@ -696,14 +811,14 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
             })
 
             # DELIVERING
-            lat, lon = random_coords(dzone, rng)
+            lat, lon = offset_coords(dzone, next(offsets))
             mid_ts = (delivery["pickup_ms"] + delivery["delivered_ms"]) // 2
             events.append({
-                "event_id": new_uuid(rng),
+                "event_id": next(uuid_iter),
                 "courier_id": cid,
                 "event_type": "DELIVERING",
                 "timestamp": mid_ts,
-                "processing_timestamp": mid_ts + rng.randint(1000, 5000),
+                "processing_timestamp": mid_ts + randint(1000, 5000),
                 "zone_id": delivery["zone_id"],
                 "latitude": lat,
                 "longitude": lon,
@@ -714,18 +829,14 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
             })
 
             # AVAILABLE again after delivery — courier stays in delivery zone
-            after_dt = datetime.fromtimestamp(
-                delivery["delivered_ms"] / 1000, tz=timezone.utc
-            ).replace(tzinfo=None)
-            after_dt += timedelta(seconds=rng.randint(30, 120))
-            after_ms = epoch_ms(after_dt)
-            lat, lon = random_coords(dzone, rng)
+            after_ms = delivery["delivered_ms"] + randint(30, 120) * 1000
+            lat, lon = offset_coords(dzone, next(offsets))
             events.append({
-                "event_id": new_uuid(rng),
+                "event_id": next(uuid_iter),
                 "courier_id": cid,
                 "event_type": "AVAILABLE",
                 "timestamp": after_ms,
-                "processing_timestamp": after_ms + rng.randint(1000, 5000),
+                "processing_timestamp": after_ms + randint(1000, 5000),
                 "zone_id": delivery["zone_id"],
                 "latitude": lat,
                 "longitude": lon,
@@ -734,33 +845,25 @@ def generate_courier_events(cfg, zones, couriers, delivery_log, courier_state,
                 "is_duplicate": False,
                 "app_version": app_version,
             })
+            last_ts = max(last_ts, after_ms)
             # Update current zone reference for the next delivery
             zone = dzone
 
         # OFFLINE at end of shift (unless went offline mid-delivery)
         if not went_offline_mid:
-            courier_events_for_cid = [e for e in events if e.get("courier_id") == cid]
-            last_ts = max(
-                (e["timestamp"] for e in courier_events_for_cid),
-                default=online_ms,
-            )
-            offline_dt = datetime.fromtimestamp(
-                last_ts / 1000, tz=timezone.utc
-            ).replace(tzinfo=None)
-            offline_dt += timedelta(minutes=rng.randint(5, 30))
-            offline_ms = epoch_ms(offline_dt)
+            offline_ms = last_ts + randint(5, 30) * 60_000
             # Courier's final zone is whatever zone they last delivered to
             final_zone = zone_map.get(
                 courier_state.get(cid, {}).get("zone", initial_zone_id),
                 zone,
             )
-            lat, lon = random_coords(final_zone, rng)
+            lat, lon = offset_coords(final_zone, next(offsets))
             events.append({
-                "event_id": new_uuid(rng),
+                "event_id": next(uuid_iter),
                 "courier_id": cid,
                 "event_type": "OFFLINE",
                 "timestamp": offline_ms,
-                "processing_timestamp": offline_ms + rng.randint(1000, 5000),
+                "processing_timestamp": offline_ms + randint(1000, 5000),
                 "zone_id": final_zone["id"],
                 "latitude": lat,
                 "longitude": lon,
@@ -786,15 +889,19 @@ def inject_duplicates(events, prob, rng, stats, feed_name):
     if prob <= 0 or not events:
         return
     num_dups = max(1, int(len(events) * prob))
-    candidates = list(events)
-    rng.shuffle(candidates)
-    for e in candidates[:num_dups]:
-        dup = dict(e)
-        dup["event_id"] = new_uuid(rng)
-        dup["is_duplicate"] = True
-        dup["processing_timestamp"] = e["processing_timestamp"] + rng.randint(100, 5000)
-        events.append(dup)
-        stats["duplicates_injected_" + feed_name] += 1
+    originals = rng.sample(events, min(num_dups, len(events)))
+    event_ids = new_uuids(rng, len(originals))
+    delays = uniform_ints(rng, len(originals), 100, 5000)
+    events.extend([
+        {
+            **e,
+            "event_id": event_id,
+            "is_duplicate": True,
+            "processing_timestamp": e["processing_timestamp"] + delay,
+        }
+        for e, event_id, delay in zip(originals, event_ids, delays)
+    ])
+    stats["duplicates_injected_" + feed_name] += len(originals)
 
 
 def inject_late_events(events, prob, rng, stats, feed_name):
@@ -804,11 +911,21 @@ def inject_late_events(events, prob, rng, stats, feed_name):
     num_late = max(1, int(len(events) * prob))
     exclude = {"ORDER_PLACED", "ONLINE"}
     candidates = [e for e in events if e["event_type"] not in exclude]
-    rng.shuffle(candidates)
-    for e in candidates[:num_late]:
-        e["timestamp"] -= rng.randint(300_000, 900_000)  # 5-15 min late
-        # processing_timestamp stays — it represents actual ingestion time
-        stats["late_events_" + feed_name] += 1
+    late = rng.sample(candidates, min(num_late, len(candidates)))
+    # 5-15 min late; processing_timestamp stays — it represents actual ingestion time
+    for e, shift in zip(late, uniform_ints(rng, len(late), 300_000, 900_000)):
+        e["timestamp"] -= shift
+    stats["late_events_" + feed_name] += len(late)
+
+
+def finalize_events(events, cfg, rng, stats, feed_name):
+    """
+    Apply the delivery-side edge cases to a finished feed: duplicates, then
+    late arrivals (which may hit a duplicate), then shuffle into arrival order.
+    """
+    inject_duplicates(events, cfg["duplicate_prob"], rng, stats, feed_name)
+    inject_late_events(events, cfg["late_prob"], rng, stats, feed_name)
+    rng.shuffle(events)
 
 
 # ---------------------------------------------------------------------------
@@ -824,9 +941,7 @@ def generate_validation_report(order_events, courier_events, stats, cfg):
     report["total_courier_events"] = len(courier_events)
 
     # --- Order event type breakdown ---
-    order_types = defaultdict(int)
-    for e in order_events:
-        order_types[e["event_type"]] += 1
+    order_types = Counter(map(itemgetter("event_type"), order_events))
     total_oe = max(len(order_events), 1)
     report["order_event_breakdown"] = {
         k: {"count": v, "pct": round(v / total_oe * 100, 2)}
@@ -834,9 +949,7 @@ def generate_validation_report(order_events, courier_events, stats, cfg):
     }
 
     # --- Courier event type breakdown ---
-    courier_types = defaultdict(int)
-    for e in courier_events:
-        courier_types[e["event_type"]] += 1
+    courier_types = Counter(map(itemgetter("event_type"), courier_events))
     total_ce = max(len(courier_events), 1)
     report["courier_event_breakdown"] = {
         k: {"count": v, "pct": round(v / total_ce * 100, 2)}
@@ -870,30 +983,30 @@ def generate_validation_report(order_events, courier_events, stats, cfg):
         report["zone_surge"] = None
 
     # --- Order value stats ---
-    values = stats.get("order_values", [])
-    if values:
+    value_count = stats.get("order_value_count", 0)
+    if value_count:
         report["order_value_stats"] = {
-            "avg": round(sum(values) / len(values), 2),
-            "min": round(min(values), 2),
-            "max": round(max(values), 2),
+            "avg": round(stats["order_value_sum"] / value_count, 2),
+            "min": round(stats["order_value_min"], 2),
+            "max": round(stats["order_value_max"], 2),
         }
     else:
         report["order_value_stats"] = {"avg": 0, "min": 0, "max": 0}
 
     # --- Orders per zone ---
-    opz = dict(stats.get("orders_per_zone", {}))
+    opz = stats.get("orders_per_zone", {})
     total_orders_all = max(sum(opz.values()), 1)
     report["orders_per_zone"] = {
         k: {"count": v, "pct": round(v / total_orders_all * 100, 2)}
-        for k, v in sorted(opz.items())
+        for k, v in opz.items()
     }
 
     # --- Couriers per zone ---
-    report["couriers_per_zone"] = dict(sorted(stats.get("couriers_per_zone", {}).items()))
+    report["couriers_per_zone"] = dict(stats.get("couriers_per_zone", {}))
 
     # --- Peak hour distribution ---
-    oph = dict(stats.get("orders_per_hour", {}))
-    report["orders_per_hour"] = {str(h): oph.get(h, 0) for h in range(24)}
+    oph = stats.get("orders_per_hour", [0] * 24)
+    report["orders_per_hour"] = {str(h): oph[h] for h in range(24)}
 
     # --- Data quality warnings ---
     warnings = []
@@ -922,26 +1035,103 @@ def generate_validation_report(order_events, courier_events, stats, cfg):
 # Serialisation helpers
 # ---------------------------------------------------------------------------
 
+# Events are flat dicts, so the circular-reference check can be skipped.
+# Output is byte-identical to json.dumps() with default arguments.
+EVENT_ENCODER = json.JSONEncoder(check_circular=False)
+# Events encoded per write call in write_json
+JSON_WRITE_BATCH = 1 << 16
+# Maximum lines held before stream_events writes to stdout
+STREAM_FLUSH_EVENTS = 1000
+
+
 def load_schema(path):
     """Load an AVRO schema from a .avsc file."""
     with open(path) as f:
         return json.load(f)
 
 
+def iter_batches(iterable, size):
+    """Yield successive lists of up to `size` items from any iterable."""
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
 def write_json(events, path):
-    """Write events as newline-delimited JSON."""
-    with open(path, "w") as f:
-        for e in events:
-            f.write(json.dumps(e) + "\n")
-    print("  Written {} events -> {}".format(len(events), path))
+    """
+    Write events as newline-delimited JSON. Accepts any iterable; events are
+    encoded and written in bounded batches so memory stays O(batch size).
+    """
+    encode = EVENT_ENCODER.encode
+    count = 0
+    with open(path, "w", buffering=1 << 20) as f:
+        for batch in iter_batches(events, JSON_WRITE_BATCH):
+            f.write("\n".join(map(encode, batch)) + "\n")
+            count += len(batch)
+    print("  Written {} events -> {}".format(count, path))
+
 
+def write_avro(events, parsed_schema, path, codec=DEFAULTS["avro_codec"]):
+    """
+    Write events to an AVRO file as one batched, block-compressed container.
+    Accepts any iterable; parsed_schema must come from fastavro.parse_schema
+    (parse once, reuse).
+    """
+    count = 0
+
+    def counted():
+        # Count records as fastavro pulls them, so events can be an iterator
+        nonlocal count
+        for e in events:
+            count += 1
+            yield e
 
-def write_avro(events, schema_dict, path):
-    """Write events to an AVRO file."""
-    parsed = fastavro.parse_schema(schema_dict)
     with open(path, "wb") as f:
-        fastavro.writer(f, parsed, events)
-    print("  Written {} events -> {}".format(len(events), path))
+        fastavro.writer(f, parsed_schema, counted(), codec=codec,
+                        sync_interval=AVRO_SYNC_INTERVAL)
+    print("  Written {} events -> {}".format(count, path))
+
+
+def write_parquet(events, parsed_schema, path):
+    """
+    Write events to a columnar Parquet file (zstd, dictionary-encoded).
+    Column types are derived from the AVRO schema; requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {
+        "string": pa.string(),
+        "long": pa.int64(),
+        "float": pa.float32(),
+        "boolean": pa.bool_(),
+    }
+    fields = []
+    for field in parsed_schema["fields"]:
+        ftype = field["type"]
+        nullable = isinstance(ftype, list)
+        if nullable:
+            ftype = next(t for t in ftype if t != "null")
+        if isinstance(ftype, dict) and ftype.get("type") == "enum":
+            ftype = "string"
+        fields.append(pa.field(field["name"], arrow_types[ftype], nullable=nullable))
+    schema = pa.schema(fields)
+
+    # One pass over the events fills every column, so any iterable works
+    columns = {name: [] for name in schema.names}
+    appends = [(name, columns[name].append) for name in schema.names]
+    count = 0
+    for e in events:
+        for name, append in appends:
+            append(e[name])
+        count += 1
+    table = pa.Table.from_pydict(columns, schema=schema)
+    pq.write_table(table, path, compression="zstd", use_dictionary=True,
+                   data_page_size=1 << 20)
+    print("  Written {} events -> {}".format(count, path))
 
 
 # ---------------------------------------------------------------------------
@@ -956,34 +1146,54 @@ def stream_events(order_events, courier_events, speed_factor):
     speed_factor: N means 1 real second = N simulated seconds.
     Default 60 => 1 real second = 1 simulated minute.
     """
-    tagged = []
-    for e in order_events:
-        rec = dict(e)
-        rec["_feed"] = "order_events"
-        tagged.append(rec)
-    for e in courier_events:
-        rec = dict(e)
-        rec["_feed"] = "courier_events"
-        tagged.append(rec)
-
-    tagged.sort(key=lambda x: x["timestamp"])
+    by_ts = itemgetter("timestamp")
+    encode = EVENT_ENCODER.encode
+
+    def tagged(events, feed):
+        # "_feed" is spliced into the encoded JSON at emit time rather than
+        # copying every event dict to add the key
+        suffix = ', "_feed": {}}}\n'.format(encode(feed))
+        for e in sorted(events, key=by_ts):
+            yield e["timestamp"], e, suffix
+
+    # Each feed is sorted on its own, then merged lazily; on equal timestamps
+    # order events come first, as with a stable sort of the concatenated feeds
+    merged = heapq.merge(tagged(order_events, "order_events"),
+                         tagged(courier_events, "courier_events"),
+                         key=itemgetter(0))
+
+    # Lines are buffered and written in one call just before each sleep (and
+    # every STREAM_FLUSH_EVENTS lines), so a consumer sees an event no later
+    # than its simulated time without paying a write+flush per event
+    out = sys.stdout
+    buf = []
+
+    def flush():
+        out.write("".join(buf))
+        out.flush()
+        buf.clear()
 
     prev_ts = None
-    for event in tagged:
-        if prev_ts is not None:
-            diff_ms = event["timestamp"] - prev_ts
-            if diff_ms > 0 and speed_factor > 0:
-                sleep_secs = (diff_ms / 1000.0) / speed_factor
-                # Cap max sleep to avoid hanging on big gaps
-                sleep_secs = min(sleep_secs, 5.0)
-                if sleep_secs > 0.001:
-                    time_module.sleep(sleep_secs)
-        prev_ts = event["timestamp"]
-        try:
-            sys.stdout.write(json.dumps(event) + "\n")
-            sys.stdout.flush()
-        except BrokenPipeError:
-            break
+    try:
+        for ts, event, suffix in merged:
+            if prev_ts is not None:
+                diff_ms = ts - prev_ts
+                if diff_ms > 0 and speed_factor > 0:
+                    sleep_secs = (diff_ms / 1000.0) / speed_factor
+                    # Cap max sleep to avoid hanging on big gaps
+                    sleep_secs = min(sleep_secs, 5.0)
+                    if sleep_secs > 0.001:
+                        if buf:
+                            flush()
+                        time_module.sleep(sleep_secs)
+            prev_ts = ts
+            buf.append(encode(event)[:-1] + suffix)
+            if len(buf) >= STREAM_FLUSH_EVENTS:
+                flush()
+        if buf:
+            flush()
+    except BrokenPipeError:
+        pass
 
 
 # ---------------------------------------------------------------------------
@@ -1040,22 +1250,45 @@ def parse_args(argv=None):
                    help="Streaming speed: 1 real second = N simulated seconds")
     p.add_argument("--output-dir", type=str, default=DEFAULTS["output_dir"],
                    help="Directory to write output files")
+    p.add_argument("--avro-codec", type=str, default=DEFAULTS["avro_codec"],
+                   choices=AVRO_CODECS,
+                   help="Compression codec for the AVRO output files")
+    p.add_argument("--parquet", action="store_true", default=False,
+                   help="Also write each feed as a Parquet file (requires pyarrow)")
     p.add_argument("--seed", type=int, default=DEFAULTS["seed"],
                    help="Random seed for reproducibility")
-    return p.parse_args(argv)
+    args = p.parse_args(argv)
+    if args.parquet and importlib.util.find_spec("pyarrow") is None:
+        p.error("--parquet requires pyarrow (pip install pyarrow)")
+    # fastavro compresses snappy blocks with cramjam, or python-snappy as a fallback
+    if (args.avro_codec == "snappy"
+            and importlib.util.find_spec("cramjam") is None
+            and importlib.util.find_spec("snappy") is None):
+        p.error("--avro-codec snappy requires cramjam or python-snappy "
+                "(pip install cramjam)")
+    return args
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def init_stats():
-    """Initialise the statistics tracking dictionary."""
+def init_stats(zone_ids):
+    """
+    Initialise the statistics tracking dictionary. Per-zone tallies are
+    seeded in sorted zone order so the report can use them as-is; zone_ids
+    must cover every zone the run can produce, as the tallies have no
+    missing-key fallback.
+    """
+    zone_ids = sorted(zone_ids)
     return {
-        "orders_per_zone": defaultdict(int),
-        "orders_per_hour": defaultdict(int),
-        "couriers_per_zone": defaultdict(int),
-        "order_values": [],
+        "orders_per_zone": dict.fromkeys(zone_ids, 0),
+        "orders_per_hour": [0] * 24,
+        "couriers_per_zone": dict.fromkeys(zone_ids, 0),
+        "order_value_count": 0,
+        "order_value_sum": 0.0,
+        "order_value_min": math.inf,
+        "order_value_max": -math.inf,
         "duplicates_injected_order": 0,
         "duplicates_injected_courier": 0,
         "late_events_order": 0,
@@ -1110,27 +1343,27 @@ def run_generator(args):
         "seed": args.seed,
     }
 
-    stats = init_stats()
-
     # Build entities
     zones = build_zones(cfg["city"], cfg["num_zones"])
+    stats = init_stats([z["id"] for z in zones])
     restaurants = build_restaurants(cfg["num_restaurants"], zones, rng)
     couriers_list = build_couriers(cfg["num_couriers"], zones, rng)
     customers = build_customers(max(50, cfg["num_orders"] // 3), rng)
 
     # Step 1: Generate base placements
-    placements = generate_placements(cfg, restaurants, customers, rng, base_date)
+    open_by_hour = restaurants_by_hour(restaurants)
+    placements = generate_placements(cfg, open_by_hour, customers, rng, base_date)
 
     # Step 2: Add fraud clusters
     if cfg["fraud_cluster_prob"] > 0:
-        add_fraud_clusters(placements, cfg, customers, restaurants, rng, base_date, stats)
+        add_fraud_clusters(placements, cfg, customers, open_by_hour, rng, base_date, stats)
 
     # Step 3: Add zone surge
     if cfg["zone_surge_event"]:
         add_zone_surge(placements, cfg, zones, restaurants, customers, rng, base_date, stats)
 
     # Step 4: Sort placements chronologically
-    placements.sort(key=lambda x: x["placed_dt"])
+    placements.sort(key=itemgetter("placed_ms"))
 
     # Step 5: Process into order events (with zone-aware courier assignment)
     order_events, delivery_log, courier_state = process_placements(
@@ -1138,17 +1371,13 @@ def run_generator(args):
     )
 
     # Step 6: Post-process order events
-    inject_duplicates(order_events, cfg["duplicate_prob"], rng, stats, "order")
-    inject_late_events(order_events, cfg["late_prob"], rng, stats, "order")
-    rng.shuffle(order_events)
+    finalize_events(order_events, cfg, rng, stats, "order")
 
     # Step 7: Generate courier events
     courier_events = generate_courier_events(
         cfg, zones, couriers_list, delivery_log, courier_state, rng, base_date, stats,
     )
-    inject_duplicates(courier_events, cfg["duplicate_prob"], rng, stats, "courier")
-    inject_late_events(courier_events, cfg["late_prob"], rng, stats, "courier")
-    rng.shuffle(courier_events)
+    finalize_events(courier_events, cfg, rng, stats, "courier")
 
     # Step 8: Validation report
     report = generate_validation_report(order_events, courier_events, stats, cfg)
@@ -1181,20 +1410,28 @@ def main():
 
     # Load schemas
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    order_schema = load_schema(os.path.join(script_dir, "schemas", "order_event.avsc"))
-    courier_schema = load_schema(os.path.join(script_dir, "schemas", "courier_event.avsc"))
+    order_schema = fastavro.parse_schema(
+        load_schema(os.path.join(script_dir, "schemas", "order_event.avsc")))
+    courier_schema = fastavro.parse_schema(
+        load_schema(os.path.join(script_dir, "schemas", "courier_event.avsc")))
 
     print("Writing output files...")
     write_json(order_events, os.path.join(args.output_dir, "order_events.json"))
-    write_avro(order_events, order_schema, os.path.join(args.output_dir, "order_events.avro"))
+    write_avro(order_events, order_schema,
+               os.path.join(args.output_dir, "order_events.avro"), args.avro_codec)
     write_json(courier_events, os.path.join(args.output_dir, "courier_events.json"))
     write_avro(courier_events, courier_schema,
-               os.path.join(args.output_dir, "courier_events.avro"))
+               os.path.join(args.output_dir, "courier_events.avro"), args.avro_codec)
+    if args.parquet:
+        write_parquet(order_events, order_schema,
+                      os.path.join(args.output_dir, "order_events.parquet"))
+        write_parquet(courier_events, courier_schema,
+                      os.path.join(args.output_dir, "courier_events.parquet"))
 
     # Write validation report
     report_path = os.path.join(args.output_dir, "validation_report.json")
     with open(report_path, "w") as f:
-        json.dump(report, f, indent=2)
+        f.write(json.dumps(report, indent=2))
     print("  Written validation report -> {}".format(report_path))
 
     # Print summary
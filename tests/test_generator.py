@@ -7,11 +7,15 @@ Run with:
 
 import json
 import os
+import random
 import sys
 from collections import defaultdict
+from itertools import groupby
+from operator import ge, itemgetter
 
 import pytest
 import fastavro
+from fastavro.validation import validate_many
 
 # Allow importing from the generator package
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "generator"))
@@ -22,7 +26,7 @@ import generator
 # Fixtures
 # ---------------------------------------------------------------------------
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 def generated_data():
     """Run the generator once with a fixed seed and return results."""
     args = generator.parse_args([
@@ -46,14 +50,56 @@ def generated_data():
 
 @pytest.fixture(scope="module")
 def order_lifecycles(generated_data):
-    """Group order events by order_id for lifecycle analysis."""
-    lifecycles = defaultdict(list)
-    for e in generated_data["order_events"]:
-        lifecycles[e["order_id"]].append(e)
-    # Sort each lifecycle by timestamp
-    for oid in lifecycles:
-        lifecycles[oid].sort(key=lambda x: x["timestamp"])
-    return dict(lifecycles)
+    """
+    Group order events by order_id for lifecycle analysis. Each lifecycle
+    carries the views the tests share: its non-duplicate events sorted by
+    timestamp, the ORDER_PLACED event, and one presence flag per lifecycle
+    step.
+    """
+    # One sort by (order_id, timestamp), then each lifecycle is a contiguous run
+    ordered = sorted(generated_data["order_events"],
+                     key=itemgetter("order_id", "timestamp"))
+    lifecycles = {}
+    for oid, group in groupby(ordered, key=itemgetter("order_id")):
+        events = list(group)
+        non_dup = [e for e in events if not e["is_duplicate"]]
+        types = frozenset(e["event_type"] for e in non_dup)
+        lifecycles[oid] = {
+            "non_dup": non_dup,
+            "placed": next((e for e in non_dup if e["event_type"] == "ORDER_PLACED"), None),
+            "has_placed": "ORDER_PLACED" in types,
+            "has_courier_assigned": "COURIER_ASSIGNED" in types,
+            "has_picked_up": "PICKED_UP" in types,
+            "is_delivered": "DELIVERED" in types,
+            "is_cancelled": "CANCELLED" in types,
+        }
+    return lifecycles
+
+
+def run_small(seed):
+    """Run a small 30-order generation for the given seed."""
+    args = generator.parse_args([
+        "--num-orders", "30", "--seed", str(seed), "--date", "2026-01-15",
+    ])
+    order_events, courier_events, _, _ = generator.run_generator(args)
+    return order_events, courier_events
+
+
+@pytest.fixture(scope="session")
+def repro_runs():
+    """Small runs for the reproducibility tests, one per seed, generated once."""
+    return {seed: run_small(seed) for seed in (999, 111, 222)}
+
+
+@pytest.fixture(scope="module")
+def avro_schemas():
+    """Parse both AVRO schemas once for the whole module."""
+    schema_dir = os.path.join(os.path.dirname(__file__), "..", "generator", "schemas")
+    schemas = {}
+    for feed in ("order", "courier"):
+        with open(os.path.join(schema_dir, "{}_event.avsc".format(feed))) as f:
+            schemas[feed] = fastavro.parse_schema(json.load(f))
+    return schemas
 
 
 # ---------------------------------------------------------------------------
@@ -64,32 +110,25 @@ class TestOrderLifecycle:
 
     def test_every_order_has_placed(self, order_lifecycles):
         """Every unique order_id must have at least one ORDER_PLACED event."""
-        for oid, events in order_lifecycles.items():
-            types = {e["event_type"] for e in events if not e["is_duplicate"]}
-            assert "ORDER_PLACED" in types, (
-                "Order {} is missing ORDER_PLACED event".format(oid)
-            )
+        missing = [oid for oid, lc in order_lifecycles.items() if not lc["has_placed"]]
+        assert not missing, "Orders missing ORDER_PLACED event: {}".format(missing)
 
     def test_delivered_orders_have_courier_assigned(self, order_lifecycles):
         """Every DELIVERED order must have a COURIER_ASSIGNED event."""
-        for oid, events in order_lifecycles.items():
-            non_dup = [e for e in events if not e["is_duplicate"]]
-            types = {e["event_type"] for e in non_dup}
-            if "DELIVERED" in types:
-                assert "COURIER_ASSIGNED" in types, (
+        for oid, lc in order_lifecycles.items():
+            if lc["is_delivered"]:
+                assert lc["has_courier_assigned"], (
                     "Order {} is DELIVERED but missing COURIER_ASSIGNED".format(oid)
                 )
 
     def test_cancelled_orders_no_pickup_or_delivered(self, order_lifecycles):
         """CANCELLED orders must never have PICKED_UP or DELIVERED events."""
-        for oid, events in order_lifecycles.items():
-            non_dup = [e for e in events if not e["is_duplicate"]]
-            types = {e["event_type"] for e in non_dup}
-            if "CANCELLED" in types:
-                assert "PICKED_UP" not in types, (
+        for oid, lc in order_lifecycles.items():
+            if lc["is_cancelled"]:
+                assert not lc["has_picked_up"], (
                     "Order {} is CANCELLED but has PICKED_UP".format(oid)
                 )
-                assert "DELIVERED" not in types, (
+                assert not lc["is_delivered"], (
                     "Order {} is CANCELLED but has DELIVERED".format(oid)
                 )
 
@@ -100,9 +139,8 @@ class TestOrderLifecycle:
         """
         late_count = generated_data["stats"].get("late_events_order", 0)
         violations = 0
-        for oid, events in order_lifecycles.items():
-            non_dup = [e for e in events if not e["is_duplicate"]]
-            non_dup.sort(key=lambda x: x["timestamp"])
+        for oid, lc in order_lifecycles.items():
+            non_dup = lc["non_dup"]
             for i in range(1, len(non_dup)):
                 if non_dup[i]["timestamp"] < non_dup[i - 1]["timestamp"]:
                     violations += 1
@@ -128,18 +166,14 @@ class TestDuplicates:
 
     def test_duplicate_shares_order_id(self, generated_data):
         """Duplicate events share an order_id with a non-duplicate event."""
-        non_dup_oids = {
-            e["order_id"]
-            for e in generated_data["order_events"]
-            if not e["is_duplicate"]
-        }
+        non_dup_oids = set()
+        dup_oids = set()
         for e in generated_data["order_events"]:
-            if e["is_duplicate"]:
-                assert e["order_id"] in non_dup_oids, (
-                    "Duplicate event has order_id {} not in original events".format(
-                        e["order_id"]
-                    )
-                )
+            (dup_oids if e["is_duplicate"] else non_dup_oids).add(e["order_id"])
+        orphans = dup_oids - non_dup_oids
+        assert not orphans, (
+            "Duplicate events have order_ids not in original events: {}".format(orphans)
+        )
 
     def test_duplicates_injected(self, generated_data):
         """With duplicate_prob > 0, at least some duplicates should exist."""
@@ -159,27 +193,27 @@ class TestDuplicates:
 
 class TestAvroValidation:
 
-    def _get_schema(self, name):
-        schema_dir = os.path.join(
-            os.path.dirname(__file__), "..", "generator", "schemas"
-        )
-        path = os.path.join(schema_dir, name)
-        with open(path) as f:
-            return fastavro.parse_schema(json.load(f))
-
-    def test_order_events_validate(self, generated_data):
+    def test_order_events_validate(self, generated_data, avro_schemas):
         """All order events must validate against the AVRO schema."""
-        schema = self._get_schema("order_event.avsc")
-        for i, event in enumerate(generated_data["order_events"]):
-            assert fastavro.validate(event, schema), (
+        schema = avro_schemas["order"]
+        events = generated_data["order_events"]
+        if validate_many(events, schema, raise_errors=False):
+            return
+        # Re-check one by one only on failure, to report the offending event
+        for i, event in enumerate(events):
+            assert fastavro.validate(event, schema, raise_errors=False), (
                 "Order event {} failed AVRO validation: {}".format(i, event)
             )
 
-    def test_courier_events_validate(self, generated_data):
+    def test_courier_events_validate(self, generated_data, avro_schemas):
         """All courier events must validate against the AVRO schema."""
-        schema = self._get_schema("courier_event.avsc")
-        for i, event in enumerate(generated_data["courier_events"]):
-            assert fastavro.validate(event, schema), (
+        schema = avro_schemas["courier"]
+        events = generated_data["courier_events"]
+        if validate_many(events, schema, raise_errors=False):
+            return
+        # Re-check one by one only on failure, to report the offending event
+        for i, event in enumerate(events):
+            assert fastavro.validate(event, schema, raise_errors=False), (
                 "Courier event {} failed AVRO validation: {}".format(i, event)
             )
 
@@ -201,29 +235,19 @@ class TestFraudClusters:
         """
         # Group cancelled orders by customer
         customer_cancellations = defaultdict(list)
-        for oid, events in order_lifecycles.items():
-            non_dup = [e for e in events if not e["is_duplicate"]]
-            types = {e["event_type"] for e in non_dup}
-            if "CANCELLED" in types:
-                placed = [e for e in non_dup if e["event_type"] == "ORDER_PLACED"]
-                if placed:
-                    customer_cancellations[placed[0]["customer_id"]].append(
-                        placed[0]["timestamp"]
-                    )
-
-        # At least one customer should have 3+ cancellations in a 15-min window
-        found_cluster = False
-        for cid, timestamps in customer_cancellations.items():
-            if len(timestamps) < 3:
-                continue
-            timestamps.sort()
-            for i in range(len(timestamps) - 2):
-                window = timestamps[i + 2] - timestamps[i]
-                if window <= 15 * 60 * 1000:  # 15 minutes in ms
-                    found_cluster = True
-                    break
-            if found_cluster:
-                break
+        for oid, lc in order_lifecycles.items():
+            placed = lc["placed"]
+            if lc["is_cancelled"] and placed is not None:
+                customer_cancellations[placed["customer_id"]].append(placed["timestamp"])
+
+        # At least one customer should have 3+ cancellations in a 15-min window:
+        # with sorted timestamps, some ts[i + 2] - ts[i] is within 15 minutes
+        window_ms = 15 * 60 * 1000
+        found_cluster = any(
+            b - a <= window_ms
+            for ts in map(sorted, customer_cancellations.values())
+            for a, b in zip(ts, ts[2:])
+        )
         assert found_cluster, "No fraud cluster pattern detected (3+ cancels in 15 min)"
 
 
@@ -233,35 +257,21 @@ class TestFraudClusters:
 
 class TestReproducibility:
 
-    def test_seed_produces_identical_output(self):
+    def test_seed_produces_identical_output(self, repro_runs):
         """Running with the same --seed must produce identical events."""
-        args1 = generator.parse_args([
-            "--num-orders", "30", "--seed", "999", "--date", "2026-01-15",
-        ])
-        args2 = generator.parse_args([
-            "--num-orders", "30", "--seed", "999", "--date", "2026-01-15",
-        ])
-        oe1, ce1, _, _ = generator.run_generator(args1)
-        oe2, ce2, _, _ = generator.run_generator(args2)
+        oe1, ce1 = repro_runs[999]
+        oe2, ce2 = run_small(999)
 
         assert len(oe1) == len(oe2), "Order event count differs"
         assert len(ce1) == len(ce2), "Courier event count differs"
 
-        for a, b in zip(oe1, oe2):
-            assert a == b, "Order events differ"
-        for a, b in zip(ce1, ce2):
-            assert a == b, "Courier events differ"
+        assert oe1 == oe2, "Order events differ"
+        assert ce1 == ce2, "Courier events differ"
 
-    def test_different_seed_produces_different_output(self):
+    def test_different_seed_produces_different_output(self, repro_runs):
         """Different seeds must produce different events."""
-        args1 = generator.parse_args([
-            "--num-orders", "30", "--seed", "111", "--date", "2026-01-15",
-        ])
-        args2 = generator.parse_args([
-            "--num-orders", "30", "--seed", "222", "--date", "2026-01-15",
-        ])
-        oe1, _, _, _ = generator.run_generator(args1)
-        oe2, _, _, _ = generator.run_generator(args2)
+        oe1, _ = repro_runs[111]
+        oe2, _ = repro_runs[222]
 
         # At least the event IDs should differ
         ids1 = {e["event_id"] for e in oe1}
@@ -277,20 +287,22 @@ class TestProcessingTimestamp:
 
     def test_processing_timestamp_exists(self, generated_data):
         """All events must have a processing_timestamp field."""
-        for e in generated_data["order_events"]:
-            assert "processing_timestamp" in e
-            assert isinstance(e["processing_timestamp"], int)
-        for e in generated_data["courier_events"]:
-            assert "processing_timestamp" in e
-            assert isinstance(e["processing_timestamp"], int)
+        for feed in ("order_events", "courier_events"):
+            events = generated_data[feed]
+            assert all("processing_timestamp" in e for e in events), (
+                "Some {} lack processing_timestamp".format(feed)
+            )
+            value_types = set(map(type, map(itemgetter("processing_timestamp"), events)))
+            assert value_types <= {int}, (
+                "Non-int processing_timestamp in {}: {}".format(feed, value_types)
+            )
 
     def test_processing_timestamp_after_or_near_event_time(self, generated_data):
         """processing_timestamp should generally be >= timestamp for non-late events."""
         # For non-late events (most events), processing_timestamp >= timestamp
-        order_ok = 0
-        for e in generated_data["order_events"]:
-            if e["processing_timestamp"] >= e["timestamp"]:
-                order_ok += 1
+        events = generated_data["order_events"]
+        order_ok = sum(map(ge, map(itemgetter("processing_timestamp"), events),
+                           map(itemgetter("timestamp"), events)))
         # Most events should satisfy this (late events may not)
         ratio = order_ok / max(len(generated_data["order_events"]), 1)
         assert ratio > 0.8, (
@@ -345,6 +357,15 @@ class TestValidationReport:
         assert report["total_order_events"] == len(generated_data["order_events"])
         assert report["total_courier_events"] == len(generated_data["courier_events"])
 
+    def test_per_zone_tallies_cover_every_zone(self, generated_data):
+        """Per-zone tallies are keyed by every zone, in sorted order, and sum to the totals."""
+        args = generated_data["args"]
+        zone_ids = sorted(z["id"] for z in generator.build_zones(args.city, args.num_zones))
+        report = generated_data["report"]
+        assert list(report["orders_per_zone"]) == zone_ids
+        assert list(report["couriers_per_zone"]) == zone_ids
+        assert sum(report["couriers_per_zone"].values()) == args.num_couriers
+
 
 # ---------------------------------------------------------------------------
 # Test: App version field
@@ -354,9 +375,134 @@ class TestAppVersion:
 
     def test_app_version_present(self, generated_data):
         """All events must have an app_version field."""
-        for e in generated_data["order_events"]:
-            assert "app_version" in e
-            assert e["app_version"] in ("1.0.0", "1.1.0")
-        for e in generated_data["courier_events"]:
-            assert "app_version" in e
-            assert e["app_version"] in ("1.0.0", "1.1.0")
+        for feed in ("order_events", "courier_events"):
+            versions = {e.get("app_version") for e in generated_data[feed]}
+            assert versions <= {"1.0.0", "1.1.0"}, (
+                "Unexpected app_version values in {}: {}".format(feed, versions)
+            )
+
+
+# ---------------------------------------------------------------------------
+# Test: Order time sampling
+# ---------------------------------------------------------------------------
+
+class TestOrderTimeSampling:
+
+    def test_hour_cdf_is_normalised(self):
+        """The hourly CDF must be non-decreasing and end at 1."""
+        cdf = generator.hour_cdf(False, 2.5)
+        assert len(cdf) == 24
+        assert all(a <= b for a, b in zip(cdf, cdf[1:]))
+        assert cdf[-1] == pytest.approx(1.0)
+
+    def test_peak_hours_dominate(self):
+        """Sampled order times should concentrate in the lunch/dinner peaks."""
+        rng = random.Random(7)
+        secs = generator.sample_order_times(rng, False, 2.5, 2000)
+        assert all(0 <= s < 86400 for s in secs)
+        hours = [s // 3600 for s in secs]
+        peak = sum(1 for h in hours if h in generator.SURGE_HOURS)
+        night = sum(1 for h in hours if h < 6)
+        assert peak > 0.5 * len(hours)
+        assert night < 0.05 * len(hours)
+
+
+# ---------------------------------------------------------------------------
+# Test: Courier assignment
+# ---------------------------------------------------------------------------
+
+class TestCourierAssignment:
+
+    @pytest.fixture
+    def pool(self):
+        zones = generator.build_zones("madrid")
+        couriers = [
+            {"id": "courier_001", "zone_id": "zone_north"},
+            {"id": "courier_002", "zone_id": "zone_center"},
+        ]
+        state = {c["id"]: {"zone": c["zone_id"], "available_at": 0} for c in couriers}
+        dispatch = generator.init_dispatch(
+            couriers, generator.zone_distance_matrix(zones)
+        )
+        return dispatch, state
+
+    def test_same_zone_preferred(self, pool):
+        """An idle courier in the order's zone is assigned first."""
+        dispatch, state = pool
+        assert generator.assign_courier(dispatch, state, "zone_center", 0) == "courier_002"
+
+    def test_nearest_zone_fallback(self, pool):
+        """With no courier in the zone, the nearest idle courier is assigned."""
+        dispatch, state = pool
+        # zone_south is closer to zone_center than to zone_north
+        assert generator.assign_courier(dispatch, state, "zone_south", 0) == "courier_002"
+
+    def test_busy_courier_not_reassigned_until_free(self, pool):
+        """A busy courier is only reassigned once no idle courier remains."""
+        dispatch, state = pool
+        first = generator.assign_courier(dispatch, state, "zone_center", 0)
+        generator.release_courier(dispatch, first, 5000)
+        second = generator.assign_courier(dispatch, state, "zone_center", 1000)
+        assert second != first
+        generator.release_courier(dispatch, second, 9000)
+        # Nobody is idle at t=2000: the courier freeing up soonest is picked
+        assert generator.assign_courier(dispatch, state, "zone_center", 2000) == first
+
+
+# ---------------------------------------------------------------------------
+# Test: Output writers
+# ---------------------------------------------------------------------------
+
+class TestOutputWriters:
+
+    def test_avro_codec(self, generated_data, avro_schemas, tmp_path):
+        """AVRO files are deflate-compressed by default and honour --avro-codec."""
+        assert generator.parse_args([]).avro_codec == "deflate"
+        assert generator.parse_args(["--avro-codec", "null"]).avro_codec == "null"
+        schema = avro_schemas["courier"]
+        events = generated_data["courier_events"]
+        for codec in (None, "null", "deflate"):
+            path = str(tmp_path / "courier_events_{}.avro".format(codec))
+            if codec is None:
+                generator.write_avro(events, schema, path)
+            else:
+                generator.write_avro(events, schema, path, codec)
+            with open(path, "rb") as f:
+                reader = fastavro.reader(f)
+                assert reader.codec == (codec or "deflate")
+                assert sum(1 for _ in reader) == len(events)
+
+    def test_parquet_round_trip(self, generated_data, avro_schemas, tmp_path):
+        """Parquet output keeps every row, writes enums as strings, and keeps AVRO nullability."""
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        tables = {}
+        for feed in ("order", "courier"):
+            events = generated_data["{}_events".format(feed)]
+            path = str(tmp_path / "{}_events.parquet".format(feed))
+            generator.write_parquet(iter(events), avro_schemas[feed], path)
+            table = pq.read_table(path)
+            assert table.num_rows == len(events)
+            assert table.schema.field("event_type").type == pa.string()
+            assert table.column("event_type").to_pylist() == [e["event_type"] for e in events]
+            tables[feed] = table
+
+        order_schema = tables["order"].schema
+        for name in ("cancellation_reason", "courier_id"):
+            field = order_schema.field(name)
+            assert field.type == pa.string()
+            assert field.nullable, "{} should be nullable".format(name)
+        assert tables["order"].column("cancellation_reason").null_count > 0
+        assert not tables["courier"].schema.field("courier_id").nullable
+
+    def test_writers_accept_iterators(self, generated_data, avro_schemas, tmp_path):
+        """write_json and write_avro consume one-shot iterators, not just lists."""
+        events = generated_data["order_events"]
+        json_path = str(tmp_path / "order_events.json")
+        avro_path = str(tmp_path / "order_events.avro")
+        generator.write_json(iter(events), json_path)
+        generator.write_avro(iter(events), avro_schemas["order"], avro_path)
+        with open(json_path) as f:
+            assert sum(1 for _ in f) == len(events)
+        with open(avro_path, "rb") as f:
+            assert sum(1 for _ in fastavro.reader(f)) == len(events)